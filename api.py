@@ -0,0 +1,181 @@
+"""
+This file contains the Python API for running the pipeline in-process, e.g. from notebooks or scheduled jobs
+"""
+import os.path
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import pandas as pd
+
+from constants import *
+from main import clean_raw_data, build_sample_data, summarize_stats, summarize_geography, generate_visualizations
+
+"""
+Result of cleaning the raw data.
+Frames are copied on access so callers can never change a cached result.
+"""
+@dataclass(frozen=True)
+class CleanResult:
+    _data: pd.DataFrame
+
+    @property
+    def data(self):
+        return self._data.copy()
+
+"""
+Result of summarizing the clean data (or its stratified sample when approximate).
+Frames are copied on access so callers can never change a cached result; data copies the whole dataset,
+so prefer summary and top_ten_diagnoses when those are enough.
+"""
+@dataclass(frozen=True)
+class SummaryResult:
+    _data: pd.DataFrame
+    _summary: pd.DataFrame
+    _top_ten_diagnoses: pd.Series
+    approximate: bool
+
+    @property
+    def data(self):
+        return self._data.copy()
+
+    @property
+    def summary(self):
+        return self._summary.copy()
+
+    @property
+    def top_ten_diagnoses(self):
+        return self._top_ten_diagnoses.copy()
+
+    ## Returns the dictionary generate_visualizations expects, as copies.
+    def as_summary_stats(self):
+        return {
+            'df': self.data,
+            'summary_df': self.summary,
+            'top_ten_diagnoses': self.top_ten_diagnoses,
+        }
+
+"""
+Result of summarizing the clean data per geography.
+Tables are copied on access so callers can never change a cached result.
+"""
+@dataclass(frozen=True)
+class GeographyResult:
+    _tables: tuple
+    approximate: bool
+
+    ## Returns the table ('top_diagnoses' or 'num_diagnoses') for a geography ('STATE' or 'CENSUS_DIVISION').
+    def table(self, geography, table):
+        return dict(self._tables)[(geography, table)].copy()
+
+"""
+Runs the pipeline in-process with its paths and options given as parameters.
+Results are cached in memory, keyed on the inputs (including the size and modification time of the raw file
+and of the clean data at output_path),
+and the least recently used results are evicted once cache_size results are held.
+The clean data is only written to disk when output_path is given. Without it, decode can name the only columns
+to decode while cleaning; the summaries decode any other column they need when they run.
+"""
+class Pipeline:
+    def __init__(self, input_path=input_file_path, output_path=None, cache_size=16, decode=None):
+        self.input_path = os.path.expanduser(input_path)
+        self.output_path = output_path
+        if output_path is not None and decode is not None:
+            raise ValueError("decode only applies when cleaning in memory; written clean data is always fully decoded")
+        self.decode = decode
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    ## Returns the cached value for the key, computing and caching it first if needed.
+    def _cached(self, key, compute):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        value = compute()
+        self._cache[key] = value
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return value
+
+    ## Returns the key identifying the current raw input and, when it exists, the clean data at output_path.
+    def _input_key(self):
+        input_stat = os.stat(self.input_path)
+        output_key = None
+        if self.output_path is not None and os.path.isfile(self.output_path):
+            output_stat = os.stat(self.output_path)
+            output_key = output_stat.st_size, output_stat.st_mtime_ns
+
+        return self.input_path, input_stat.st_size, input_stat.st_mtime_ns, self.output_path, output_key
+
+    ## Returns the clean data frame shared by every stage, without copying it.
+    def _clean_data(self):
+        return self.clean()._data
+
+    ## Returns the data the summaries run on: the clean data or its stratified sample.
+    def _summary_data(self, sample):
+        if not sample:
+            return self._clean_data()
+        self.clean()
+        return self._cached(('sample',) + self._input_key(), lambda: build_sample_data(self._clean_data()))
+
+    ## Cleans the raw data, reusing the clean data at output_path when it is newer than the raw data.
+    ## Returns a CleanResult.
+    def clean(self):
+        def compute():
+            if self.output_path is None:
+                return CleanResult(clean_raw_data(False, self.input_path, decode=self.decode))
+            if os.path.isfile(self.output_path) and \
+                    os.path.getmtime(self.output_path) >= os.path.getmtime(self.input_path):
+                return CleanResult(pd.read_csv(self.output_path))
+            return CleanResult(clean_raw_data(True, self.input_path, self.output_path))
+
+        key = ('clean',) + self._input_key()
+        result = self._cached(key, compute)
+
+        ## Writing output_path changes its key; keep the result under the key later calls will use
+        written_key = ('clean',) + self._input_key()
+        if written_key != key:
+            self._cache.pop(key, None)
+            self._cached(written_key, lambda: result)
+
+        return result
+
+    ## Summarizes the stats, approximately from a stratified sample when sample is set.
+    ## Returns a SummaryResult.
+    def summarize(self, sample=False):
+        self.clean()
+
+        def compute():
+            summary_stats = summarize_stats(self._summary_data(sample))
+            return SummaryResult(summary_stats['df'], summary_stats['summary_df'],
+                                 summary_stats['top_ten_diagnoses'], sample)
+
+        return self._cached(('summary', sample) + self._input_key(), compute)
+
+    ## Summarizes the stats per state and census division, approximately from a stratified sample when sample is set.
+    ## Returns a GeographyResult.
+    def summarize_geography(self, sample=False):
+        self.clean()
+
+        def compute():
+            geography_stats = summarize_geography(self._summary_data(sample), write_to_csv=False)
+            tables = tuple(((geography, table), table_df)
+                           for geography, tables in geography_stats.items() for table, table_df in tables.items())
+            return GeographyResult(tables, sample)
+
+        return self._cached(('geography', sample) + self._input_key(), compute)
+
+    ## Generates the visualizations from the (cached) summary.
+    ## generate_visualizations does not change its inputs, so the cached frames are shared instead of copied.
+    def visualize(self, sample=False):
+        summary = self.summarize(sample)
+        generate_visualizations(None, {
+            'df': summary._data,
+            'summary_df': summary._summary,
+            'top_ten_diagnoses': summary._top_ten_diagnoses,
+        })
+
+    ## Empties the in-memory cache.
+    def clear_cache(self):
+        self._cache.clear()
@@ -0,0 +1,82 @@
+"""
+This file benchmarks worker memory when sharing the clean data through shared memory versus pickling it
+"""
+import os
+import argparse
+import multiprocessing
+
+import pandas as pd
+
+from constants import *
+from shared_data import *
+
+## Reads the private (unshared) memory of the current process in MB.
+## Returns the private memory.
+def private_memory_mb():
+    private = 0
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                private += int(line.split()[1])
+
+    return private / 1024
+
+
+## Worker that attaches to the shared dataset and reads every column.
+## Puts the growth of its private memory on the queue.
+def shared_worker(spec, queue):
+    before = private_memory_mb()
+    with attach_shared_dataset(spec) as columns:
+        sum(int(values.sum()) for values in columns.values())
+        queue.put(private_memory_mb() - before)
+
+
+## Worker that loads its own pickled copy of the clean data and reads every column.
+## Puts the growth of its private memory on the queue.
+def pickled_worker(pickle_path, queue):
+    before = private_memory_mb()
+    df = pd.read_pickle(pickle_path)
+    sum(len(df[column].value_counts()) for column in df.columns)
+    queue.put(private_memory_mb() - before)
+
+
+## Starts the given number of workers and waits for them.
+## Returns the total private memory the workers added in MB.
+def run_workers(context, target, args, num_workers):
+    queue = context.Queue()
+    workers = [context.Process(target=target, args=args + (queue,)) for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+
+    total = sum(queue.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+
+    return total
+
+
+## Runs the benchmark for each worker count and prints the total worker memory of both approaches.
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-input", "--input", help="clean data to share", default=output_file)
+    parser.add_argument("-workers", "--workers", help="comma separated worker counts", default="1,2,4,8")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input)
+    pickle_path = args.input + '.benchmark.pkl'
+    df.to_pickle(pickle_path)
+
+    context = multiprocessing.get_context('spawn')
+    print(f"{'Workers':>8} {'Shared memory (MB)':>20} {'Pickled copies (MB)':>20}")
+
+    try:
+        with publish_shared_dataset(df) as spec:
+            for num_workers in [int(count) for count in args.workers.split(',')]:
+                shared = run_workers(context, shared_worker, (spec,), num_workers)
+                pickled = run_workers(context, pickled_worker, (pickle_path,), num_workers)
+                print(f"{num_workers:>8} {shared:>20.1f} {pickled:>20.1f}")
+    finally:
+        os.remove(pickle_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+This file checks that clean data written from raw data with unknown diagnosis codes still runs through every stage
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from constants import *
+from main import clean_raw_data, summarize_stats, summarize_geography, build_sample_data
+
+## Writes raw data where some rows have an unknown MH1 code and some an unknown MH2 code.
+def write_raw_data(raw_path, num_rows=2000):
+    rng = np.random.default_rng(0)
+    raw_df = pd.DataFrame({
+        'AGE': rng.integers(4, 15, num_rows),
+        'ETHNIC': rng.integers(1, 5, num_rows),
+        'RACE': rng.integers(1, 7, num_rows),
+        'GENDER': rng.integers(1, 3, num_rows),
+        'MH1': rng.integers(1, 14, num_rows),
+        'MH2': rng.choice([-9] + list(range(1, 14)), num_rows),
+        'MH3': rng.choice([-9] + list(range(1, 14)), num_rows),
+        'STATEFIP': rng.choice(list(state_codes), num_rows),
+        'DIVISION': rng.integers(0, 10, num_rows),
+    })
+    raw_df.loc[:49, ['MH1', 'MH2', 'MH3']] = [20, -9, -9]
+    raw_df.loc[50:99, ['MH2', 'MH3']] = [20, -9]
+    raw_df.to_csv(raw_path, index=False)
+
+
+## Cleans the raw data to CSV and runs the stages on the clean file it wrote.
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        raw_path = os.path.join(temp_dir, 'raw.csv')
+        clean_path = os.path.join(temp_dir, 'clean_data.csv')
+        write_raw_data(raw_path)
+
+        clean_raw_data(True, raw_path, clean_path)
+        df = pd.read_csv(clean_path)
+
+        ## Unknown MH1 rows are dropped and unknown MH2 codes stay in the diagnosis set
+        assert len(df) == 1950, len(df)
+        assert df['ALL_DIAGNOSES'].notna().all()
+        assert df['ALL_DIAGNOSES'].str.split(', ').apply(lambda x: '20' in x).sum() == 50
+
+        summary_stats = summarize_stats(None, clean_path)
+        assert summary_stats['df']['NUM_DIAGNOSES'].notna().all()
+
+        summarize_geography(None, False, clean_path)
+
+        sample_df = build_sample_data(df)
+        assert sample_df['NUM_DIAGNOSES'].notna().all()
+
+    print("Clean data with unknown diagnosis codes runs through every stage")
+
+if __name__ == "__main__":
+    main()
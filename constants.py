@@ -5,6 +5,18 @@ input_file_path = '~/Downloads/mhcld-puf-2020-csv.csv'
 
 output_file = 'clean_data.csv'
 
+## Cleaning progress is committed next to the output file and only renamed to it once every chunk is processed
+partial_suffix = '.partial'
+checkpoint_suffix = '.checkpoint'
+
+## Size in bytes of each block of the raw input cleaned and committed at a time
+chunk_size_bytes = 64 * 1024 * 1024
+
+## Stratified sample of the clean data used by the --sample preview mode
+sample_output_file = 'sample_data.csv'
+sample_fraction = 0.02
+sample_random_state = 2020
+
 column_names = ['AGE', 'ETHNIC', 'RACE', 'GENDER', 'MH1', 'MH2', 'MH3', 'STATEFIP', 'DIVISION']
 
 age_codes = {
@@ -128,6 +140,14 @@ division_codes = {
     9: 'Pacific'
 }
 
+renamed_columns = {'STATEFIP': 'STATE', 'DIVISION': 'CENSUS_DIVISION'}
+
+## Columns of the clean data, in the order they are written
+clean_column_names = ['AGE', 'GENDER', 'STATE', 'CENSUS_DIVISION', 'ALL_DIAGNOSES', 'RACE/ETHNICITY']
+
+## Columns that are always decoded because the merged ALL_DIAGNOSES and RACE/ETHNICITY columns are built from their values
+merged_columns = ['MH1', 'MH2', 'MH3', 'ETHNIC', 'RACE']
+
 cols_codes_mapping = {
     'AGE': age_codes,
     'ETHNIC': ethnic_codes,
@@ -150,3 +170,21 @@ breakout_info = {
         'AGE': age_levels
     }
 
+## Geographic columns summarized by --geography, how many comorbidity sets to keep per area and where the tables go
+geography_columns = ['STATE', 'CENSUS_DIVISION']
+geography_top_k = 10
+geography_output_file = 'geography_{geography}_{table}.csv'
+
+## Levels of each column in the integer-coded dataset shared with worker processes
+encoded_levels = {
+    'AGE': age_levels,
+    'GENDER': gender_levels,
+    'RACE/ETHNICITY': re_levels,
+    'STATE': list(state_codes.values()),
+    'CENSUS_DIVISION': list(division_codes.values()),
+}
+diagnosis_levels = [diagnosis for diagnosis in mh_codes.values() if diagnosis is not None]
+
+## Columns the --sample preview mode stratifies on
+sample_strata = ['NUM_DIAGNOSES'] + list(breakout_info)
+
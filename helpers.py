@@ -1,6 +1,11 @@
 """
 This file contains helper methods
 """
+import os
+import json
+
+import numpy as np
+import pandas as pd
 
 """
 Merges columns based on range.
@@ -54,3 +59,191 @@ def plot_stacked_bar(df, title, column_prefix, levels_per_column, sns, plt):
 
     return plt.show()
 
+
+"""
+Reads the raw file in blocks of whole lines starting at a byte offset.
+Yields the header line, each block and the byte offset where the block ends.
+"""
+def read_raw_blocks(file_path, start_offset, chunk_size):
+    with open(os.path.expanduser(file_path), 'rb') as raw_file:
+        header = raw_file.readline()
+        raw_file.seek(max(start_offset, len(header)))
+
+        while True:
+            block = raw_file.read(chunk_size)
+            if not block:
+                break
+
+            ## Finish the last line so no row is split between two blocks
+            if not block.endswith(b'\n'):
+                block += raw_file.readline()
+
+            yield header, block, raw_file.tell()
+
+"""
+Reads the cleaning checkpoint for an input file.
+Returns the checkpoint or None if there is no usable checkpoint.
+"""
+def read_checkpoint(checkpoint_path, input_path, partial_path):
+    if not (os.path.isfile(checkpoint_path) and os.path.isfile(partial_path)):
+        return None
+
+    with open(checkpoint_path) as checkpoint:
+        state = json.load(checkpoint)
+
+    ## Only resume against the same, unchanged raw input
+    input_stat = os.stat(os.path.expanduser(input_path))
+    if state['input_size'] != input_stat.st_size or state['input_mtime'] != input_stat.st_mtime:
+        return None
+
+    return state
+
+"""
+Atomically writes the cleaning checkpoint.
+A crash leaves either the previous or the new checkpoint, never a torn one.
+"""
+def write_checkpoint(checkpoint_path, input_path, input_offset, output_offset, unknown_codes):
+    input_stat = os.stat(os.path.expanduser(input_path))
+    state = {
+        'input_size': input_stat.st_size,
+        'input_mtime': input_stat.st_mtime,
+        'input_offset': input_offset,
+        'output_offset': output_offset,
+        'unknown_codes': unknown_codes,
+    }
+
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'w') as checkpoint:
+        json.dump(state, checkpoint)
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+    os.replace(temp_path, checkpoint_path)
+
+"""
+Draws a stratified sample with the same fraction of rows from every stratum.
+Every stratum keeps at least two rows (or all of its rows when smaller) so its variance can be estimated.
+Returns the sample with the stratum sizes and the weight that scales each row back up to the full data.
+"""
+def stratified_sample(df, strata_columns, fraction, random_state):
+    strata = df.groupby(strata_columns, dropna=False, sort=False).ngroup()
+    stratum_sizes = strata.map(strata.value_counts())
+    sample_sizes = (stratum_sizes * fraction).round().clip(lower=stratum_sizes.clip(upper=2))
+
+    ## Shuffle once, then keep the first rows of every stratum
+    shuffled = strata.sample(frac=1, random_state=random_state)
+    position = shuffled.groupby(shuffled).cumcount()
+    keep = position[position < sample_sizes[position.index]].index
+
+    sample = df.loc[keep].copy()
+    sample['STRATUM'] = strata[keep]
+    sample['STRATUM_SIZE'] = stratum_sizes[keep]
+    sample['STRATUM_SAMPLE_SIZE'] = sample_sizes[keep].astype(int)
+    sample['SAMPLE_WEIGHT'] = sample['STRATUM_SIZE'] / sample['STRATUM_SAMPLE_SIZE']
+
+    return sample.sort_index()
+
+"""
+Counts the rows of a dataframe, scaled up by the sample weights when the dataframe is a sample.
+Returns the (estimated) row count.
+"""
+def count_rows(df):
+    if 'SAMPLE_WEIGHT' in df.columns:
+        return int(round(df['SAMPLE_WEIGHT'].sum()))
+    return len(df)
+
+"""
+Counts the values of a column, scaled up by the sample weights when the dataframe is a sample.
+Returns the (estimated) value counts.
+"""
+def weighted_value_counts(df, column):
+    if 'SAMPLE_WEIGHT' in df.columns:
+        counts = df.groupby(column)['SAMPLE_WEIGHT'].sum().round().astype(int)
+        return counts.sort_values(ascending=False).rename('count')
+    return df[column].value_counts()
+
+"""
+Estimates the 95% margin of error of the scaled up count of each value from a stratified sample.
+Returns the margins of error indexed by value, missing where the sample cannot support an estimate.
+"""
+def estimate_count_error(df, column, values):
+    strata = df.groupby('STRATUM')[['STRATUM_SIZE', 'STRATUM_SAMPLE_SIZE']].first()
+    hits = (df[df[column].isin(values)].groupby([column, 'STRATUM']).size()
+            .unstack(fill_value=0).reindex(index=values, columns=strata.index, fill_value=0))
+
+    population = strata['STRATUM_SIZE']
+    sampled = strata['STRATUM_SAMPLE_SIZE']
+    proportion = hits / sampled
+
+    ## Variance of a stratified total, with finite population correction; fully sampled strata add none.
+    ## A stratum with a single row sampled out of several has no variance estimate, so the margin is unknown.
+    estimable = (sampled >= population) | (sampled > 1)
+    variance = (population ** 2 * (1 - sampled / population) * proportion * (1 - proportion)
+                / (sampled - 1).clip(lower=1).where(estimable))
+
+    return (1.96 * variance.sum(axis=1, skipna=False) ** 0.5).round().astype('Int64')
+
+"""
+Counts the rows of each group, scaled up by the sample weights when the dataframe is a sample.
+Returns the (estimated) counts indexed by the group keys.
+"""
+def grouped_counts(df, keys):
+    if 'SAMPLE_WEIGHT' in df.columns:
+        return df.groupby(keys, dropna=False)['SAMPLE_WEIGHT'].sum().round().astype(int)
+    return df.groupby(keys, dropna=False).size()
+
+"""
+Compiles a code map into a dense lookup array indexed by code minus the smallest code.
+Returns the lookup array, which codes in its range are known and the smallest code.
+"""
+def compile_code_map(codes):
+    offset = min(codes)
+    lookup = np.full(max(codes) - offset + 1, None, dtype=object)
+    known = np.zeros(len(lookup), dtype=bool)
+    for code, value in codes.items():
+        lookup[code - offset] = value
+        known[code - offset] = True
+
+    return lookup, known, offset
+
+"""
+Compiles every distinct code map once, so columns sharing a map share its lookup array.
+Returns the compiled code maps keyed by the (renamed) column name.
+"""
+def compile_code_maps(cols_codes_mapping, renamed_columns):
+    compiled = {}
+    code_maps = {}
+    for column, codes in cols_codes_mapping.items():
+        if id(codes) not in compiled:
+            compiled[id(codes)] = compile_code_map(codes)
+        code_maps[renamed_columns.get(column, column)] = compiled[id(codes)]
+
+    return code_maps
+
+"""
+Decodes a column of codes with a single take from its compiled lookup array.
+Missing values stay missing; codes not in the map (including non-numeric ones) are decoded as missing and counted.
+Callers decide what an unknown code means for the row (clean_chunk drops unknown MH1 and keeps unknown MH2/MH3 codes).
+Returns the decoded values and the number of unknown codes.
+"""
+def decode_codes(series, code_map):
+    lookup, known, offset = code_map
+
+    ## Integer columns (the usual case) skip the conversion needed to find missing values
+    if pd.api.types.is_integer_dtype(series.dtype):
+        index = series.to_numpy(dtype=np.int64) - offset
+        missing = np.zeros(len(index), dtype=bool)
+        in_range = (index >= 0) & (index < len(lookup))
+    else:
+        codes = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float)
+        missing = series.isna().to_numpy()
+        ## Non-numeric codes fall out of range so they are counted as unknown
+        index = np.where(np.isnan(codes), -1, codes - offset)
+        in_range = (index >= 0) & (index < len(lookup)) & (index == np.floor(index))
+
+    index = np.where(in_range, index, 0).astype(np.intp)
+    unknown = ~missing & ~(in_range & known[index])
+
+    decoded = lookup.take(index)
+    decoded[missing | unknown] = None
+
+    return pd.Series(decoded, index=series.index, name=series.name), int(unknown.sum())
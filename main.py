@@ -1,3 +1,5 @@
+import io
+import json
 import os.path
 import argparse
 import pandas as pd
@@ -7,24 +9,68 @@ import seaborn as sns
 from constants import *
 from helpers import *
 
-## Cleans the raw data with the option to write clean data to a CSV.
-## Returns the dataframe to be used to Summarize the Stats and/or Generate Visualizations.
-def clean_raw_data(write_to_csv):
-    ## Create Dataframe with only applicable columns
-    df = pd.read_csv(input_file_path, usecols=column_names)
+## Every code map is compiled into a lookup array once, when the module loads
+code_maps = compile_code_maps(cols_codes_mapping, renamed_columns)
+
+
+## Decodes the given columns from their codes to the mapped values.
+## Returns the decoded dataframe and the number of unknown codes per column.
+def decode_columns(df, columns):
+    decoded = {}
+    unknown_codes = {}
+    for column in columns:
+        decoded[column], unknown_codes[column] = decode_codes(df[column], code_maps[column])
+
+    return df.assign(**decoded), unknown_codes
+
+
+## Decodes the columns a stage needs that still hold codes (see the decode option of clean_raw_data).
+## Returns the dataframe with those columns decoded.
+def ensure_decoded(df, columns):
+    coded = [col for col in columns if col in code_maps and pd.api.types.is_numeric_dtype(df[col])]
+    if not coded:
+        return df
+
+    df, unknown_codes = decode_columns(df, coded)
+    report_unknown_codes(unknown_codes)
+
+    return df
+
+
+## Prints how many codes in each column were not in its code map.
+def report_unknown_codes(unknown_codes):
+    for column, count in unknown_codes.items():
+        if count:
+            print(f"Decoded {count} unknown codes in {column} as missing")
+
 
+## Cleans a block of raw data, decoding only the columns in decode (plus merged_columns) when given.
+## Rows whose MH1 is an unknown code are dropped like rows without MH1; unknown MH2/MH3 codes are kept in
+## ALL_DIAGNOSES as the code itself (e.g. '20') so those rows are not re-bucketed into a smaller diagnosis set.
+## Returns the cleaned dataframe and the number of unknown codes per column.
+def clean_chunk(df, decode=None):
     ## Filtering unusable or unnecessary data
     filter_rows(df, ((df['AGE'] == -9) | (df['AGE'] <= 3)))
     filter_rows(df, ((df['ETHNIC'] == -9) & (df['RACE'] == -9)))
     filter_rows(df, (df['GENDER'] == -9))
     filter_rows(df, (df['MH1'] == -9))
 
-    ## Replace all codes to the mapped values
-    for column, code in cols_codes_mapping.items():
-        df[column] = df[column].replace(code)
-
     ## Rename columns
-    df = df.rename(columns={'STATEFIP': 'STATE', 'DIVISION': 'CENSUS_DIVISION'})
+    df = df.rename(columns=renamed_columns)
+
+    ## Replace all (or only the requested) codes to the mapped values
+    columns = list(code_maps) if decode is None else merged_columns + [col for col in decode if col not in merged_columns]
+    diagnosis_codes = df[['MH1', 'MH2', 'MH3']]
+    df, unknown_codes = decode_columns(df, columns)
+
+    ## Without a known primary diagnosis the row is as unusable as one without MH1
+    filter_rows(df, df['MH1'].isna())
+
+    ## Keep unknown secondary diagnosis codes visible instead of silently shrinking the diagnosis set
+    for column in ['MH2', 'MH3']:
+        codes = diagnosis_codes.loc[df.index, column]
+        unknown = df[column].isna() & codes.notna() & (codes != -9)
+        df.loc[unknown, column] = codes[unknown].astype(str)
 
     ## Merging all MH columns and merging 'ETHNIC' and 'RACE'
     df['ALL_DIAGNOSES'] = merge_columns(df, ['MH1', 'MH2', 'MH3'])
@@ -33,32 +79,158 @@ def clean_raw_data(write_to_csv):
     ## Drop single instance rows after merge
     df.drop(columns=['ETHNIC', 'RACE', 'MH1', 'MH2', 'MH3'], inplace=True)
 
-    ## Write to csv
-    if write_to_csv:
-        df.to_csv(output_file, index=False, chunksize=10000)
+    return df, unknown_codes
 
-    return df
+
+## Cleans the raw data with the option to write clean data to a CSV.
+## When writing to CSV the raw data is cleaned block by block and each block is committed with a checkpoint,
+## so an interrupted run resumes from the last committed block instead of starting over.
+## Without writing to CSV, decode can name the only columns to decode (e.g. ['STATE']); the rest keep their codes
+## until a stage that needs them decodes them with ensure_decoded. Written clean data is always fully decoded.
+## Returns the dataframe to be used to Summarize the Stats and/or Generate Visualizations.
+def clean_raw_data(write_to_csv, input_path=input_file_path, output_path=output_file, decode=None):
+    if write_to_csv and decode is not None:
+        raise ValueError("decode only applies when cleaning in memory; written clean data is always fully decoded")
+
+    if not write_to_csv:
+        ## Create Dataframe with only applicable columns
+        df, unknown_codes = clean_chunk(pd.read_csv(input_path, usecols=column_names), decode)
+        report_unknown_codes(unknown_codes)
+        return df
+
+    partial_path = output_path + partial_suffix
+    checkpoint_path = output_path + checkpoint_suffix
+
+    input_offset = 0
+    output_offset = 0
+    frames = []
+    unknown_codes = {}
+
+    ## Resume from the last committed block, discarding anything written after it
+    checkpoint = read_checkpoint(checkpoint_path, input_path, partial_path)
+    if checkpoint is not None:
+        input_offset = checkpoint['input_offset']
+        output_offset = checkpoint['output_offset']
+        unknown_codes = checkpoint.get('unknown_codes', {})
+        print(f"Resuming cleaning from byte {input_offset} of {input_path}")
+
+        with open(partial_path, 'r+b') as partial:
+            partial.truncate(output_offset)
+        if output_offset:
+            frames.append(pd.read_csv(partial_path))
+
+    with open(partial_path, 'ab' if checkpoint is not None else 'wb') as partial:
+        for header, block, end_offset in read_raw_blocks(input_path, input_offset, chunk_size_bytes):
+            chunk, chunk_unknown_codes = clean_chunk(pd.read_csv(io.BytesIO(header + block), usecols=column_names))
+            for column, count in chunk_unknown_codes.items():
+                unknown_codes[column] = unknown_codes.get(column, 0) + count
+
+            ## Commit the block before recording its offset
+            partial.write(chunk.to_csv(index=False, header=(output_offset == 0)).encode())
+            partial.flush()
+            os.fsync(partial.fileno())
+            output_offset = partial.tell()
+
+            write_checkpoint(checkpoint_path, input_path, end_offset, output_offset, unknown_codes)
+            frames.append(chunk)
+
+        ## Raw data without rows still gets a clean data file with a header
+        if output_offset == 0:
+            partial.write(pd.DataFrame(columns=clean_column_names).to_csv(index=False).encode())
+            partial.flush()
+            os.fsync(partial.fileno())
+
+    ## Publish the complete output in one step so a partial file is never read as clean data
+    os.replace(partial_path, output_path)
+    if os.path.isfile(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    report_unknown_codes(unknown_codes)
+
+    if not frames:
+        return pd.DataFrame(columns=clean_column_names)
+    return pd.concat(frames, ignore_index=True)
+
+
+## Builds the stratified sample used for fast approximate summaries and visualizations.
+## Returns the sample dataframe.
+def build_sample_data(df):
+    df = df.assign(NUM_DIAGNOSES=df['ALL_DIAGNOSES'].str.count(', ') + 1)
+    return stratified_sample(df, sample_strata, sample_fraction, sample_random_state)
+
+
+## Identifies a cached sample by the clean data it was drawn from and the sampling parameters.
+## Returns the cache key.
+def sample_cache_key(clean_path):
+    clean_stat = os.stat(clean_path)
+    return {
+        'clean_path': os.path.abspath(clean_path),
+        'clean_size': clean_stat.st_size,
+        'clean_mtime_ns': clean_stat.st_mtime_ns,
+        'sample_strata': sample_strata,
+        'sample_fraction': sample_fraction,
+        'sample_random_state': sample_random_state,
+    }
+
+
+## Loads the stratified sample used for fast approximate summaries and visualizations.
+## A freshly cleaned dataframe is sampled directly. Otherwise the sample of clean_path is cached in sample_path
+## and reused only while the clean data and the sampling parameters are unchanged.
+## Returns the sample dataframe.
+def load_sample_data(df, clean_path=output_file, sample_path=sample_output_file):
+    if df is not None:
+        return build_sample_data(df)
+
+    key_path = sample_path + '.key'
+    key = sample_cache_key(clean_path)
+    if os.path.isfile(sample_path) and os.path.isfile(key_path):
+        with open(key_path) as key_file:
+            if json.load(key_file) == key:
+                return pd.read_csv(sample_path)
+
+    df = pd.read_csv(clean_path)
+    sample_df = build_sample_data(df)
+
+    ## Write the cache in one step so an interrupted write is never read back as a sample, then record its key
+    if os.path.isfile(key_path):
+        os.remove(key_path)
+    sample_df.to_csv(sample_path + '.tmp', index=False)
+    os.replace(sample_path + '.tmp', sample_path)
+    with open(key_path + '.tmp', 'w') as key_file:
+        json.dump(key, key_file)
+    os.replace(key_path + '.tmp', key_path)
+
+    print(f"Sampled {len(sample_df)} of {len(df)} rows into {sample_path}")
+
+    return sample_df
 
 
 ## Summarizes the stats from the cleaned data.
+## When given a stratified sample the counts are scaled up and the top ten include a margin of error.
+## The given dataframe is left unchanged; the returned 'df' holds the sorted diagnoses and NUM_DIAGNOSES.
 ## Returns a dictionary with pertinent data to run the visualizations
-def summarize_stats(df):
+def summarize_stats(df, clean_path=output_file):
     ## If no dataframe is provided, create one from the clean data output file
-    df = pd.read_csv(output_file) if df is None else df
+    df = pd.read_csv(clean_path) if df is None else df
 
     ## Split the 'ALL_DIAGNOSES' column into individual diagnoses
-    df['NUM_DIAGNOSES'] = df['ALL_DIAGNOSES'].str.split(', ').apply(lambda x: len(x))
+    diagnoses = df['ALL_DIAGNOSES'].str.split(', ')
+    df = df.assign(NUM_DIAGNOSES=diagnoses.apply(lambda x: len(x)))
 
     ## Find the top ten most common diagnoses with two or three diagnoses
-    df['ALL_DIAGNOSES'] = df['ALL_DIAGNOSES'].str.split(', ').apply(
-        lambda x: ', '.join(sorted(x)))
+    df['ALL_DIAGNOSES'] = diagnoses.apply(lambda x: ', '.join(sorted(x)))
 
-    top_ten_diagnoses = df[df['NUM_DIAGNOSES'].isin([2, 3])]['ALL_DIAGNOSES'].value_counts().head(10)
+    top_ten_diagnoses = weighted_value_counts(df[df['NUM_DIAGNOSES'].isin([2, 3])], 'ALL_DIAGNOSES').head(10)
 
     ## Create summary dataframe
     summary_df = pd.DataFrame({'Diagnosis': top_ten_diagnoses.index, 'Count': top_ten_diagnoses.values}).reset_index(
         drop=True)
 
+    ## Approximate counts from a sample are shown with their 95% margin of error
+    if 'SAMPLE_WEIGHT' in df.columns:
+        summary_df['Margin of Error'] = estimate_count_error(df, 'ALL_DIAGNOSES', top_ten_diagnoses.index).values
+        print(f"Approximate results from a stratified sample of {len(df)} rows")
+
     print(summary_df)
 
     return {
@@ -68,18 +240,73 @@ def summarize_stats(df):
     }
 
 
+## Summarizes the stats from the cleaned data for every STATE and CENSUS_DIVISION with the option to write the tables to CSV.
+## All areas are counted in a single grouped pass instead of one national summary per area.
+## Returns a dictionary with the top comorbidity sets (with breakouts) and the NUM_DIAGNOSES distribution per geography.
+def summarize_geography(df, write_to_csv, clean_path=output_file):
+    ## If no dataframe is provided, create one from the clean data output file
+    df = pd.read_csv(clean_path) if df is None else df
+    df = ensure_decoded(df, geography_columns + list(breakout_info))
+
+    ## Sort the diagnoses in each set the same way summarize_stats does, without changing the given dataframe
+    diagnoses = df['ALL_DIAGNOSES'].str.split(', ')
+    geo_df = df[geography_columns + list(breakout_info) + [col for col in ['SAMPLE_WEIGHT'] if col in df.columns]].assign(
+        ALL_DIAGNOSES=diagnoses.apply(lambda x: ', '.join(sorted(x))),
+        NUM_DIAGNOSES=diagnoses.apply(len))
+
+    ## Count every combination of area, comorbidity set and breakout level once; every table is rolled up from this
+    set_counts = grouped_counts(geo_df[geo_df['NUM_DIAGNOSES'].isin([2, 3])],
+                                geography_columns + ['ALL_DIAGNOSES'] + list(breakout_info))
+
+    geography_stats = {}
+    for geography in geography_columns:
+        ## Keep the top comorbidity sets of each area
+        counts = set_counts.groupby(level=[geography, 'ALL_DIAGNOSES']).sum()
+        top_diagnoses = counts.sort_values(ascending=False, kind='stable').groupby(level=0).head(geography_top_k)
+
+        ## Break out the top sets of each area by gender, race/ethnicity and age
+        breakouts = []
+        for column_name, levels in breakout_info.items():
+            breakout = (set_counts.groupby(level=[geography, 'ALL_DIAGNOSES', column_name]).sum()
+                        .unstack(column_name, fill_value=0).reindex(columns=levels, fill_value=0))
+            breakout.columns = [f'{column_name}_{level}' for level in levels]
+            breakouts.append(breakout.reindex(top_diagnoses.index))
+
+        top_diagnoses_df = pd.concat([top_diagnoses.rename('Count')] + breakouts, axis=1).reset_index()
+        top_diagnoses_df = top_diagnoses_df.rename(columns={'ALL_DIAGNOSES': 'Diagnosis'})
+        top_diagnoses_df.insert(1, 'Rank', top_diagnoses_df.groupby(geography).cumcount() + 1)
+        top_diagnoses_df = top_diagnoses_df.sort_values([geography, 'Rank']).reset_index(drop=True)
+
+        ## Number of diagnoses per area, one column per count
+        num_diagnoses_df = grouped_counts(geo_df, [geography, 'NUM_DIAGNOSES']).unstack(fill_value=0).reset_index()
+        num_diagnoses_df.columns.name = None
+
+        geography_stats[geography] = {
+            'top_diagnoses': top_diagnoses_df,
+            'num_diagnoses': num_diagnoses_df,
+        }
+
+        print(top_diagnoses_df[top_diagnoses_df['Rank'] == 1][[geography, 'Diagnosis', 'Count']].to_string(index=False))
+
+        ## Write to csv
+        if write_to_csv:
+            for table, table_df in geography_stats[geography].items():
+                table_df.to_csv(geography_output_file.format(geography=geography.lower(), table=table), index=False)
+
+    return geography_stats
+
+
 ## Generates 5 visualizations based on the summary stats.
-def generate_visualizations(df, summary_stats):
+## Neither the given dataframe nor the summary stats are changed.
+def generate_visualizations(df, summary_stats, clean_path=output_file):
     ## Summarize stats from clean data if summarize_stats has not run
-    if df is None:
-        df = pd.read_csv(output_file)
-
     if summary_stats is None:
-        summary_stats = summarize_stats(df)
+        summary_stats = summarize_stats(df, clean_path)
 
+    df = ensure_decoded(summary_stats['df'], list(breakout_info))
     top_ten_diagnoses = summary_stats['top_ten_diagnoses']
-    num_diagnoses_counts = df['NUM_DIAGNOSES'].value_counts()
-    summary_df = summary_stats['summary_df']
+    num_diagnoses_counts = weighted_value_counts(df, 'NUM_DIAGNOSES')
+    summary_df = summary_stats['summary_df'].copy()
 
     ## Plot the doughnut chart of the diagnosis number frequency
     plt.figure(figsize=(8, 8))
@@ -118,7 +345,7 @@ def generate_visualizations(df, summary_stats):
         filtered_df = df[df['ALL_DIAGNOSES'] == diag]
         for column_name, levels in breakout_info.items():
             for level in levels:
-                count = len(filtered_df[(filtered_df[column_name] == level)])
+                count = count_rows(filtered_df[(filtered_df[column_name] == level)])
                 summary_df.at[i, f'{column_name}_{level}'] = count
 
     # Set diagnosis as index for plotting
@@ -140,11 +367,15 @@ def generate_visualizations(df, summary_stats):
     ## Cleaning the data only (-clean or --clean)
     ## Summarizing the data only (-summary or --summary)
     ## Generating the visualizations only (-visualize or --visualize)
+    ## Summarizing the data by state and census division only (-geography or --geography)
+    ## Summarizing and visualizing a stratified sample for fast approximate results (-sample or --sample)
 def handle_args(args):
     write_to_csv = True if args.csv else False
     clean_data_only = True if args.clean else False
     summarize_only = True if args.summary else False
     visualize_only = True if args.visualize else False
+    geography_only = True if args.geography else False
+    use_sample = True if args.sample else False
 
     if clean_data_only:
         if os.path.isfile(output_file) and write_to_csv:
@@ -152,15 +383,26 @@ def handle_args(args):
         clean_raw_data(write_to_csv)
         return True
 
+    df = None
+
     if not os.path.isfile(output_file):
-        clean_raw_data(write_to_csv)
+        df = clean_raw_data(write_to_csv)
+
+    if use_sample:
+        df = load_sample_data(df)
+    elif os.path.isfile(output_file):
+        df = None
 
     if summarize_only:
-        summarize_stats(df=None)
+        summarize_stats(df=df)
         return True
 
     if visualize_only:
-        generate_visualizations(df=None, summary_stats=None)
+        generate_visualizations(df=df, summary_stats=None)
+        return True
+
+    if geography_only:
+        summarize_geography(df=df, write_to_csv=write_to_csv)
         return True
 
     return False
@@ -173,6 +415,10 @@ def main():
     parser.add_argument("-clean", "--clean", help="clean the raw data only", action="store_true")
     parser.add_argument("-summary", "--summary", help="summarize the data only", action="store_true")
     parser.add_argument("-visualize", "--visualize", help="visualize the data only", action="store_true")
+    parser.add_argument("-geography", "--geography", help="summarize the data by state and census division only",
+                        action="store_true")
+    parser.add_argument("-sample", "--sample", help="use a stratified sample for fast approximate results",
+                        action="store_true")
     args = parser.parse_args()
 
     if handle_args(args):
@@ -185,6 +431,9 @@ def main():
         write_to_csv = True if args.csv else False
         df = clean_raw_data(write_to_csv)
 
+    if args.sample:
+        df = load_sample_data(df)
+
     summary_stats = summarize_stats(df)
     generate_visualizations(summary_stats['df'], summary_stats)
 
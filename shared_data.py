@@ -0,0 +1,112 @@
+"""
+This file contains methods to share the encoded clean data with worker processes without copying it
+"""
+import sys
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from constants import *
+
+## Byte alignment of every column inside the shared memory segment
+column_alignment = 64
+
+"""
+Encodes the clean data as integer codes per column and a bitmask of diagnoses per row.
+Codes index into encoded_levels and diagnosis_levels; -1 marks a missing or unknown value.
+Returns a dictionary of NumPy arrays.
+"""
+def encode_clean_data(df):
+    ## Codes left by lazy decoding would otherwise all be encoded as unknown
+    coded = [column for column in encoded_levels if pd.api.types.is_numeric_dtype(df[column])]
+    if coded:
+        raise ValueError(f"Columns {coded} still hold codes; decode them before sharing the clean data")
+
+    columns = {
+        column: pd.Categorical(df[column], categories=levels).codes.astype(np.int16)
+        for column, levels in encoded_levels.items()
+    }
+
+    ## Set one bit per diagnosis, ignoring repeated diagnoses on the same row
+    diagnosis_bits = {diagnosis: 1 << bit for bit, diagnosis in enumerate(diagnosis_levels)}
+    diagnoses = df['ALL_DIAGNOSES'].str.split(', ').explode().map(diagnosis_bits).dropna()
+    diagnoses = diagnoses.reset_index().drop_duplicates()
+    mask = diagnoses.groupby(diagnoses.columns[0])[diagnoses.columns[1]].sum()
+
+    columns['DIAGNOSES'] = mask.reindex(df.index, fill_value=0).to_numpy(dtype=np.int16)
+    columns['NUM_DIAGNOSES'] = (df['ALL_DIAGNOSES'].str.count(', ') + 1).to_numpy(dtype=np.int8)
+
+    return columns
+
+"""
+Lays the columns out back to back in one segment.
+Returns the layout of each column and the total size in bytes.
+"""
+def layout_columns(columns):
+    layout = {}
+    offset = 0
+    for column, values in columns.items():
+        offset = -(-offset // column_alignment) * column_alignment
+        layout[column] = (offset, values.dtype.str, len(values))
+        offset += values.nbytes
+
+    return layout, max(offset, 1)
+
+"""
+Creates NumPy views of every column in a shared memory buffer.
+Returns a dictionary of read-only arrays.
+"""
+def column_views(buffer, layout):
+    views = {}
+    for column, (offset, dtype, length) in layout.items():
+        view = np.ndarray((length,), dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+        view.flags.writeable = False
+        views[column] = view
+
+    return views
+
+"""
+Publishes the encoded clean data once into shared memory.
+Yields a small picklable spec to hand to workers, which attach with attach_shared_dataset.
+The segment is unlinked when the block exits, including on errors and Ctrl-C;
+if the process is killed outright, the multiprocessing resource tracker unlinks it.
+"""
+@contextmanager
+def publish_shared_dataset(df):
+    columns = encode_clean_data(df)
+    layout, size = layout_columns(columns)
+
+    segment = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        for column, values in columns.items():
+            offset = layout[column][0]
+            segment.buf[offset:offset + values.nbytes] = values.tobytes()
+        del columns
+
+        yield {'name': segment.name, 'layout': layout}
+    finally:
+        segment.close()
+        segment.unlink()
+
+"""
+Attaches to a dataset published by publish_shared_dataset from a worker process.
+Workers must be child processes of the publisher so they share its resource tracker.
+Yields a dictionary of read-only NumPy views into the shared segment, valid until the block exits.
+"""
+@contextmanager
+def attach_shared_dataset(spec):
+    ## Only the publisher owns the segment; Python 3.13+ lets workers attach without tracking it
+    options = {'track': False} if sys.version_info >= (3, 13) else {}
+    segment = shared_memory.SharedMemory(name=spec['name'], **options)
+    views = column_views(segment.buf, spec['layout'])
+    try:
+        yield views
+    finally:
+        views.clear()
+        try:
+            segment.close()
+        except BufferError:
+            ## The caller still holds a view; the mapping is released when the worker exits
+            pass